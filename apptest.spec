@@ -6,6 +6,8 @@ binaries = []
 hiddenimports = []
 tmp_ret = collect_all('streamlit')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
+# apptest.py imports pandas / numpy lazily through importlib, which the analysis cannot see
+hiddenimports += ['pandas', 'numpy']
 
 
 a = Analysis(
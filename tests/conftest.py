@@ -0,0 +1,32 @@
+# 测试使用临时目录中的数据库：导入 apptest 之前设置 INVENTORY_DB，导入时建库并执行全部迁移
+# 不启动后台任务执行器，也不继承分库和备份目录的设置
+import os
+import sys
+import tempfile
+
+import pytest
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='inventory_tests_')
+os.environ['INVENTORY_DB'] = os.path.join(SCRATCH_DIR, 'inventory_management.db')
+os.environ['INVENTORY_JOB_WORKERS'] = '0'
+os.environ.pop('INVENTORY_SHARD_DIR', None)
+os.environ.pop('INVENTORY_BACKUP_DIR', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import apptest  # noqa: E402
+
+
+# 共享的测试库；读缓存在每个测试开始时清空
+@pytest.fixture
+def app():
+    apptest.get_read_cache().clear()
+    return apptest
+
+
+# 每个测试独立的、已执行全部迁移的空库
+@pytest.fixture
+def fresh_pool(tmp_path):
+    pool = apptest.ConnectionPool(str(tmp_path / 'fresh.db'))
+    apptest.initialize_database(pool)
+    yield pool
+    pool.close()
@@ -0,0 +1,76 @@
+import datetime
+import json
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def backup_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'BACKUP_DIR', str(tmp_path))
+    return tmp_path
+
+
+def product_names(app):
+    return set(app.get_all_products()['商品名称'])
+
+
+# 恢复后备份之后写入的数据全部回滚；数据版本大于恢复前，各进程缓存的查询结果失效；下游同步需要重新全量同步；备份时等待中的任务不再执行
+def test_restore_rolls_back_and_fences(app, backup_dir):
+    product_id = app.add_product('备份前商品', None, 5.0, '测试')
+    job_id = app.submit_job('analyze')
+    manifest = app.create_backup(sleep=0)
+    with app.get_connection() as conn:
+        conn.execute("UPDATE jobs SET status = '已完成' WHERE job_id = ?", (job_id,))
+
+    app.update_product(product_id, '备份后改名', None, 9.0, '测试')
+    app.add_product('备份后商品', None, 1.0, '测试')
+    assert {'备份后改名', '备份后商品'} <= product_names(app)
+    versions = dict(app.get_data_versions(['products', 'stock']))
+    since = app.get_change_seq()
+
+    app.restore_backup(manifest['name'])
+
+    # 读缓存没有清空，数据版本变大使缓存的商品列表失效
+    names = product_names(app)
+    assert '备份前商品' in names and not {'备份后改名', '备份后商品'} & names
+    assert all(version > versions[table] for table, version in app.get_data_versions(['products', 'stock']))
+    with pytest.raises(app.ChangeFeedExpired):
+        app.changes_since(since)
+    with app.get_connection() as conn:
+        assert conn.execute('SELECT status FROM jobs WHERE job_id = ?', (job_id,)).fetchone()[0] == '已取消'
+    # 恢复后的写入和同步照常进行
+    seq = app.get_change_seq()
+    new_id = app.add_product('恢复后商品', None, 1.0, '测试')
+    assert [change['id'] for change in app.changes_since(seq)['changes']] == [new_id]
+
+
+def fake_backup(directory, moment):
+    name = moment.strftime('backup_%Y%m%d_%H%M%S')
+    os.makedirs(directory / name)
+    manifest = {'name': name, 'created_at': moment.strftime('%Y-%m-%d %H:%M:%S'), 'compressed': False, 'databases': [], 'seconds': 0}
+    (directory / name / 'manifest.json').write_text(json.dumps(manifest), encoding='utf-8')
+    return name
+
+
+# 保留最近 7 个备份，以及最近 30 天中每天最后一个备份；超过一天没有更新的 .partial 目录一并删除
+def test_prune_keeps_recent_and_daily_backups(app, backup_dir):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    created = [fake_backup(backup_dir, today - datetime.timedelta(days=days) + datetime.timedelta(hours=hour))
+               for days in range(40) for hour in (1, 9, 17)]
+    stale = backup_dir / 'backup_20000101_000000.partial'
+    fresh = backup_dir / 'backup_20990101_000000.partial'
+    stale.mkdir()
+    fresh.mkdir()
+    old = time.time() - 2 * 86400
+    os.utime(stale, (old, old))
+
+    app.prune_backups()
+
+    newest = sorted(created, reverse=True)
+    daily = {(today - datetime.timedelta(days=days) + datetime.timedelta(hours=17)).strftime('backup_%Y%m%d_%H%M%S') for days in range(30)}
+    expected = set(newest[:7]) | daily
+    assert {backup['name'] for backup in app.list_backups()} == expected
+    assert len(expected) == 34
+    assert not stale.exists() and fresh.exists()
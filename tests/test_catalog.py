@@ -0,0 +1,52 @@
+import uuid
+
+
+def assert_matches_database(app, index, product_ids, location):
+    with app.get_connection() as conn:
+        rows = conn.execute('SELECT product_id, name, price, category FROM products').fetchall()
+    for product_id, name, price, category in rows:
+        assert index.get_product(product_id) == {'product_id': product_id, 'name': name, 'price': price, 'category': category}
+    for product_id in product_ids:
+        assert index.get_available(product_id, location) == app.get_stock_level(product_id, location)
+        assert index.get_available(product_id) == app.get_stock_level(product_id)
+
+
+# 改价、入库、销售和新增商品之后，增量刷新的结果与数据库一致，不需要整体重新加载
+def test_refresh_applies_changes(app):
+    location = f'catalog-{uuid.uuid4().hex[:8]}'
+    first = app.add_product(f'目录商品-{location}-1', None, 10.0, '测试')
+    second = app.add_product(f'目录商品-{location}-2', None, 20.0, '测试')
+    app.add_stock(second, 8, location)
+    index = app.CatalogIndex()
+    reloads, refreshes = index.reloads, index.refreshes
+
+    app.update_product(first, f'目录商品-{location}-改名', None, 12.5, '改类')
+    app.add_stock(first, 5, location)
+    app.place_order('销售', '2025-01-01', 1, [{'product_id': second, 'quantity': 3, 'price': 20.0}], location)
+    third = app.add_product(f'目录商品-{location}-3', None, 30.0, '测试')
+    app.add_stock(third, 2, location)
+    index.refresh(force=True)
+
+    assert (index.reloads, index.refreshes) == (reloads, refreshes + 1)
+    assert index.find_by_name(f'目录商品-{location}-改名') == [first]
+    assert_matches_database(app, index, [first, second, third], location)
+
+
+# 索引游标之后的变更记录被清理后无法逐条应用，刷新时整体重新加载
+def test_pruned_changes_force_reload(app, monkeypatch):
+    location = f'catalog-{uuid.uuid4().hex[:8]}'
+    product_id = app.add_product(f'目录商品-{location}', None, 10.0, '测试')
+    index = app.CatalogIndex()
+    reloads = index.reloads
+
+    app.update_product(product_id, f'目录商品-{location}', None, 11.0, '测试')
+    app.add_stock(product_id, 4, location)
+    monkeypatch.setattr(app, 'CATALOG_CHANGES_KEEP', 0)
+    job_id = app.submit_job('prune_catalog_changes')
+    app.JOB_HANDLERS['prune_catalog_changes'](app.JobContext(job_id))
+    app.add_stock(product_id, 1, location)
+    index.refresh(force=True)
+
+    assert index.reloads == reloads + 1
+    assert index.get_price(product_id) == 11.0
+    assert_matches_database(app, index, [product_id], location)
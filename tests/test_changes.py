@@ -0,0 +1,79 @@
+import pytest
+
+
+@pytest.fixture
+def consumers(app):
+    yield
+    with app.get_connection() as conn:
+        conn.execute('DELETE FROM change_consumers')
+
+
+def read_all(app, since, limit):
+    changes = []
+    while True:
+        batch = app.changes_since(since, limit)
+        changes.extend(batch['changes'])
+        since = batch['seq']
+        if not batch['more']:
+            return changes, since
+
+
+# 同一行多次修改只返回一次最新的整行，已删除的行返回 delete
+def test_changes_since_returns_latest_rows(app):
+    since = app.get_change_seq()
+    supplier_id = app.add_supplier('变更供应商', '张三', '123', '上海')
+    app.update_supplier(supplier_id, '变更供应商', '李四', '456', '上海')
+    customer_id = app.add_customer('变更客户', '789', '北京')
+    app.delete_customer(customer_id)
+
+    batch = app.changes_since(since)
+    assert not batch['more']
+    assert batch['seq'] == app.get_change_seq()
+    changes = {(change['table'], change['id']): change for change in batch['changes']}
+    assert len(changes) == len(batch['changes']) == 2
+    supplier = changes[('suppliers', supplier_id)]
+    assert supplier['op'] == 'upsert'
+    assert supplier['row']['contact_name'] == '李四'
+    assert changes[('customers', customer_id)] == {'seq': batch['seq'], 'table': 'customers', 'id': customer_id, 'op': 'delete', 'row': None}
+    assert app.changes_since(batch['seq'])['changes'] == []
+
+
+# 分批读取不丢失变更：逐批接着上一批的位置读取，结果与一次读完相同
+def test_changes_since_in_batches(app):
+    since = app.get_change_seq()
+    supplier_ids = [app.add_supplier(f'分批供应商{i}', None, None, None) for i in range(5)]
+    changes, seq = read_all(app, since, limit=2)
+    assert [change['id'] for change in changes] == supplier_ids
+    assert seq == app.get_change_seq()
+
+
+# 只清理所有消费方都已确认的变更；清理后从更早的位置读取需要全量同步
+def test_prune_keeps_unacknowledged_changes(app, consumers):
+    since = app.get_change_seq()
+    first = app.add_supplier('清理前', None, None, None)
+    acked = app.get_change_seq()
+    second = app.add_supplier('清理后', None, None, None)
+
+    app.ack_changes('erp', acked)
+    app.ack_changes('bi', since)
+    app.prune_change_log()
+    assert [change['id'] for change in app.changes_since(since)['changes']] == [first, second]
+
+    app.ack_changes('bi', app.get_change_seq())
+    assert app.prune_change_log()[0] > 0
+    assert [change['id'] for change in app.changes_since(acked)['changes']] == [second]
+    with pytest.raises(app.ChangeFeedExpired):
+        app.changes_since(since)
+
+
+# 每个库总是保留最新的一条，全部确认并清理后仍能从当前位置继续读取
+def test_prune_keeps_latest_entry(app, consumers):
+    app.add_supplier('最新变更', None, None, None)
+    seq = app.get_change_seq()
+    app.ack_changes('erp', seq)
+    app.prune_change_log()
+    with app.get_connection() as conn:
+        assert conn.execute('SELECT seq FROM change_log').fetchall() == [(seq,)]
+    assert app.changes_since(seq)['changes'] == []
+    supplier_id = app.add_supplier('清理之后', None, None, None)
+    assert [change['id'] for change in app.changes_since(seq)['changes']] == [supplier_id]
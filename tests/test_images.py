@@ -0,0 +1,42 @@
+import io
+import os
+import sqlite3
+
+
+def test_image_chunks_do_not_hold_a_read_transaction(app):
+    data = os.urandom(300_000)
+    product_id = app.add_product('大图商品', None, 1.0, '测试', image=data)
+    with app.get_connection() as conn:
+        image_hash = conn.execute('SELECT image_hash FROM products WHERE product_id = ?', (product_id,)).fetchone()[0]
+
+    chunks = app.iter_image_chunks(image_hash, chunk_size=65536)
+    received = [next(chunks)]
+    # 读到一半时检查点仍能完成：生成器暂停期间没有未结束的读事务
+    app.add_product('检查点之前的写入', None, 1.0, '测试')
+    checkpoint = sqlite3.connect(app.DB_PATH)
+    try:
+        assert checkpoint.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0] == 0
+    finally:
+        checkpoint.close()
+    received.extend(chunks)
+    assert b''.join(received) == data
+
+
+def test_thumbnail_of_undecodable_image_is_none(app):
+    product_id = app.add_product('坏图商品', None, 1.0, '测试', image=b'not an image')
+    with app.get_connection() as conn:
+        image_hash = conn.execute('SELECT image_hash FROM products WHERE product_id = ?', (product_id,)).fetchone()[0]
+    assert app.get_thumbnail(image_hash) is None
+    assert app.thumbnail_data_uri(image_hash) is None
+
+
+def test_thumbnail_is_generated_once(app):
+    from PIL import Image
+    output = io.BytesIO()
+    Image.new('RGB', (400, 200), 'red').save(output, format='PNG')
+    product_id = app.add_product('缩略图商品', None, 1.0, '测试', image=output.getvalue())
+    with app.get_connection() as conn:
+        image_hash = conn.execute('SELECT image_hash FROM products WHERE product_id = ?', (product_id,)).fetchone()[0]
+    thumbnail = app.get_thumbnail(image_hash, max_size=50)
+    assert Image.open(io.BytesIO(thumbnail)).size == (50, 25)
+    assert app.get_thumbnail(image_hash, max_size=50) == thumbnail
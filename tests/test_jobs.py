@@ -0,0 +1,52 @@
+def job_kinds(app, job_ids):
+    with app.get_connection() as conn:
+        return [conn.execute('SELECT kind FROM jobs WHERE job_id = ?', (job_id,)).fetchone()[0] for job_id in job_ids]
+
+
+def test_first_maintenance_runs_are_staggered(app):
+    with app.get_connection() as conn:
+        conn.execute('DELETE FROM jobs')
+    # 新库上没有一类维护任务立即执行
+    assert app.schedule_due_jobs() == []
+    with app.get_connection() as conn:
+        next_runs = dict(conn.execute('''
+        SELECT kind, (julianday(created_at) - julianday('now', 'localtime')) * 86400 FROM jobs WHERE status = ? AND progress = 1
+        ''', (app.JOB_STATUSES[2],)))
+    assert set(next_runs) == set(app.MAINTENANCE_SCHEDULE)
+    next_runs = {kind: next_runs[kind] + seconds for kind, seconds in app.MAINTENANCE_SCHEDULE.items()}
+    assert all(seconds > 0 for seconds in next_runs.values())
+    assert len({round(seconds) for seconds in next_runs.values()}) == len(next_runs)
+
+    # 时间过去 10 分钟后只有首次执行最早的检查点到期
+    with app.get_connection() as conn:
+        conn.execute("UPDATE jobs SET created_at = datetime(created_at, '-600 seconds')")
+    job_ids = app.schedule_due_jobs()
+    assert job_kinds(app, job_ids) == ['checkpoint']
+    assert app.schedule_due_jobs() == []
+    with app.get_connection() as conn:
+        conn.execute('DELETE FROM jobs')
+
+
+def test_scheduled_vacuum_never_rewrites_the_database(app):
+    def run(kind):
+        job_id = app.submit_job(kind)
+        return app.JOB_HANDLERS[kind](app.JobContext(job_id))
+
+    with app.get_connection() as conn:
+        conn.execute('PRAGMA auto_vacuum=NONE')
+        conn.execute('VACUUM')
+    assert run('vacuum')['needs_convert'] == 1
+    with app.get_connection() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+
+    run('vacuum_convert')
+    with app.get_connection() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    assert run('vacuum')['needs_convert'] == 0
+    assert 'vacuum_convert' not in app.MAINTENANCE_SCHEDULE
+
+
+def test_fresh_database_uses_incremental_vacuum(fresh_pool):
+    with fresh_pool.connection() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
@@ -0,0 +1,63 @@
+import datetime
+import os
+import time
+import uuid
+
+import pytest
+
+
+# 在 UTC+8 时区下运行，本地时间与 UTC 不同才能看出换算是否正确
+@pytest.fixture
+def shanghai_time():
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Shanghai'
+    time.tzset()
+    yield
+    if previous is None:
+        os.environ.pop('TZ')
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def test_migration_converts_local_ledger_times_to_utc(app, fresh_pool, shanghai_time):
+    with fresh_pool.connection() as conn:
+        # 回到迁移 13 之前：流水触发器写本地时间
+        for trigger in ['insert', 'delete', 'update_quantity', 'update_key']:
+            conn.execute(f'DROP TRIGGER trg_stock_{trigger}_movement')
+        for statement in app.stock_movement_triggers("datetime('now', 'localtime')"):
+            conn.execute(statement)
+        conn.execute('PRAGMA user_version = 12')
+        conn.execute("INSERT INTO stock (product_id, quantity, location) VALUES (1, 5, '华东仓')")
+        conn.execute("INSERT INTO stock_snapshots (taken_at, last_movement_id) VALUES ('2025-01-01 08:00:00', 1)")
+        local = conn.execute('SELECT moved_at FROM stock_movements').fetchone()[0]
+
+        app.migrate_database(conn)
+        converted = conn.execute('SELECT moved_at FROM stock_movements').fetchone()[0]
+        assert conn.execute('SELECT taken_at FROM stock_snapshots').fetchone()[0] == '2025-01-01 00:00:00'
+        conn.execute("INSERT INTO stock (product_id, quantity, location) VALUES (1, 1, '华东仓')")
+        latest = conn.execute('SELECT moved_at FROM stock_movements ORDER BY movement_id DESC LIMIT 1').fetchone()[0]
+    shift = datetime.datetime.fromisoformat(local) - datetime.datetime.fromisoformat(converted)
+    assert shift == datetime.timedelta(hours=8)
+    assert abs(datetime.datetime.fromisoformat(latest) - datetime.datetime.fromisoformat(converted)) < datetime.timedelta(minutes=1)
+
+
+def test_stock_as_of_uses_local_time(app, shanghai_time):
+    location = f'test-{uuid.uuid4().hex[:8]}'
+    product_id = app.add_product(f'流水-{location}', None, 1.0, '测试')
+    app.add_stock(product_id, 7, location)
+    now = datetime.datetime.now()
+
+    later = (now + datetime.timedelta(seconds=2)).strftime('%Y-%m-%d %H:%M:%S')
+    assert app.get_stock_as_of(later, location)['在库数量'].tolist() == [7]
+    assert app.get_stock_as_of(now.strftime('%Y-%m-%d'), location)['在库数量'].tolist() == [7]
+
+    page, _ = app.get_page('stock_movements', filters={'location': location})
+    shown = datetime.datetime.fromisoformat(page['变动时间'].iloc[0])
+    assert abs(shown - now) < datetime.timedelta(minutes=1)
+
+
+def test_stock_as_of_before_ledger_start_is_rejected(app):
+    app.add_stock(app.add_product('流水起点', None, 1.0, '测试'), 1, 'test-start')
+    with pytest.raises(ValueError, match='Stock history starts at'):
+        app.get_stock_as_of('2000-01-01')
@@ -0,0 +1,65 @@
+import sqlite3
+
+import apptest
+
+# 引入迁移之前的表结构（products 中直接保存图片）
+LEGACY_SCHEMA = '''
+CREATE TABLE products (product_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT,
+                       price REAL NOT NULL, category TEXT NOT NULL, image BLOB);
+CREATE TABLE stock (stock_id INTEGER PRIMARY KEY AUTOINCREMENT, product_id INTEGER NOT NULL, quantity INTEGER NOT NULL, location TEXT NOT NULL);
+CREATE TABLE orders (order_id INTEGER PRIMARY KEY AUTOINCREMENT, order_type TEXT NOT NULL, order_date TEXT NOT NULL,
+                     customer_or_supplier_id INTEGER NOT NULL, total_amount REAL NOT NULL);
+CREATE TABLE suppliers (supplier_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, contact_name TEXT, phone_number TEXT, address TEXT);
+CREATE TABLE customers (customer_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, phone_number TEXT, address TEXT);
+CREATE TABLE order_details (detail_id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER NOT NULL, product_id INTEGER NOT NULL,
+                            quantity INTEGER NOT NULL, price REAL NOT NULL);
+INSERT INTO products (name, description, price, category, image) VALUES ('苹果', '红富士', 5.0, '食品', x'89504e47'), ('梨', NULL, 4.0, '食品', NULL);
+INSERT INTO stock (product_id, quantity, location) VALUES (1, 10, '华东仓'), (1, 5, '华东仓'), (2, 7, '华南仓');
+INSERT INTO orders (order_type, order_date, customer_or_supplier_id, total_amount) VALUES ('销售', '2025-01-01', 1, 10.0);
+INSERT INTO order_details (order_id, product_id, quantity, price) VALUES (1, 1, 2, 5.0);
+INSERT INTO suppliers (name, contact_name) VALUES ('果园', NULL);
+'''
+
+
+def migrate_legacy(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    with sqlite3.connect(path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+    pool = apptest.ConnectionPool(path)
+    apptest.initialize_database(pool)
+    return pool
+
+
+def test_legacy_database_migrates_to_latest_version(tmp_path):
+    pool = migrate_legacy(tmp_path)
+    with pool.connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == apptest.MIGRATIONS[-1][0]
+        # 4: 图片移到 images 表，products.image 清空
+        assert conn.execute('SELECT image IS NULL, image_hash IS NOT NULL FROM products WHERE product_id = 1').fetchone() == (1, 1)
+        assert conn.execute('SELECT COUNT(*) FROM images').fetchone()[0] == 1
+        # 3: 库存汇总从现有库存回填
+        assert conn.execute('SELECT product_id, location, on_hand FROM stock_levels ORDER BY product_id').fetchall() == [(1, '华东仓', 15), (2, '华南仓', 7)]
+        # 5: 已有订单视为已下单
+        assert conn.execute('SELECT status FROM orders').fetchone()[0] == '已下单'
+        # 6: 全文索引从现有数据重建
+        assert conn.execute("SELECT rowid FROM products_fts WHERE products_fts MATCH '苹*'").fetchall() == [(1,)]
+        # 7: 现有库存记为期初流水
+        assert conn.execute('SELECT SUM(delta) FROM stock_movements').fetchone()[0] == 22
+    pool.close()
+
+
+def test_migrations_are_idempotent(tmp_path):
+    pool = migrate_legacy(tmp_path)
+    with pool.connection() as conn:
+        before = conn.execute('SELECT type, name FROM sqlite_master ORDER BY name').fetchall()
+        apptest.migrate_database(conn)
+        assert conn.execute('SELECT type, name FROM sqlite_master ORDER BY name').fetchall() == before
+        assert conn.execute('SELECT COUNT(*) FROM stock_movements').fetchone()[0] == 3
+    pool.close()
+
+
+def test_fresh_database_has_every_migration(fresh_pool):
+    with fresh_pool.connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == apptest.MIGRATIONS[-1][0]
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'data_versions', 'stock_levels', 'images', 'stock_movements', 'jobs', 'catalog_changes', 'change_log'} <= tables
@@ -0,0 +1,109 @@
+import json
+import sqlite3
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def stocked(app):
+    location = f'test-{uuid.uuid4().hex[:8]}'
+    product_id = app.add_product(f'商品-{location}', None, 10.0, '测试')
+    app.add_stock(product_id, 5, location)
+    return product_id, location
+
+
+def count_orders(app, product_id):
+    with app.get_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM order_details WHERE product_id = ?', (product_id,)).fetchone()[0]
+
+
+def test_sale_takes_stock(app, stocked):
+    product_id, location = stocked
+    app.place_order('销售', '2025-01-01', 1, [{'product_id': product_id, 'quantity': 3, 'price': 10.0}], location)
+    assert app.get_stock_level(product_id, location) == 2
+
+
+# 任一明细库存不足时整张订单回滚：不留下订单头、明细或库存变动
+def test_insufficient_stock_writes_nothing(app, stocked):
+    product_id, location = stocked
+    lines = [{'product_id': product_id, 'quantity': 2, 'price': 10.0}, {'product_id': product_id, 'quantity': 4, 'price': 10.0}]
+    with pytest.raises(app.InsufficientStockError):
+        app.place_order('销售', '2025-01-01', 1, lines, location)
+    assert count_orders(app, product_id) == 0
+    assert app.get_stock_level(product_id, location) == 5
+
+
+@pytest.mark.parametrize('order_type, quantity, price', [
+    ('销售', -5, 10.0),
+    ('采购', -50, 10.0),
+    ('销售', 0, 10.0),
+    ('采购', 5, -1.0),
+])
+def test_invalid_lines_are_rejected(app, stocked, order_type, quantity, price):
+    product_id, location = stocked
+    with pytest.raises(ValueError):
+        app.place_order(order_type, '2025-01-01', 1, [{'product_id': product_id, 'quantity': quantity, 'price': price}], location)
+    assert count_orders(app, product_id) == 0
+    assert app.get_stock_level(product_id, location) == 5
+
+
+def test_api_rejects_negative_quantity(app, stocked):
+    product_id, location = stocked
+    order = {'order_type': '采购', 'order_date': '2025-01-01', 'customer_or_supplier_id': 1,
+             'lines': [{'product_id': product_id, 'quantity': -50, 'price': 10.0}], 'location': location}
+    status, _ = app.handle_api_request('POST', '/orders', {}, json.dumps(order).encode('utf-8'))
+    assert status == 400
+    status, body = app.handle_api_request('POST', '/orders/batch', {}, json.dumps([order]).encode('utf-8'))
+    assert status == 201 and 'error' in json.loads(body)['results'][0]
+    assert app.get_stock_level(product_id, location) == 5
+
+
+def test_stock_quantity_cannot_go_negative(app, stocked):
+    product_id, location = stocked
+    with pytest.raises(sqlite3.IntegrityError):
+        app.add_stock(product_id, -1, location)
+    status, _ = app.handle_api_request('POST', '/stock', {}, json.dumps({'product_id': product_id, 'quantity': -1, 'location': location}).encode('utf-8'))
+    assert status == 400
+
+
+# 删除已下单的订单：明细一起删除，销售退回的库存和采购入库的库存都冲回
+def test_delete_order_reverses_stock(app, stocked):
+    product_id, location = stocked
+    sale = app.place_order('销售', '2025-01-01', 1, [{'product_id': product_id, 'quantity': 3, 'price': 10.0}], location)
+    purchase = app.place_order('采购', '2025-01-01', 1, [{'product_id': product_id, 'quantity': 7, 'price': 6.0}], location)
+    assert app.get_stock_level(product_id, location) == 9
+
+    with pytest.raises(ValueError):
+        app.delete_order(sale)
+    app.delete_order(sale, location)
+    assert app.get_stock_level(product_id, location) == 12
+    status, _ = app.handle_api_request('DELETE', f'/orders/{purchase}', {'location': location}, b'')
+    assert status == 200
+    assert app.get_stock_level(product_id, location) == 5
+    assert count_orders(app, product_id) == 0
+    assert app.verify_stock_levels().empty
+
+
+# 采购入库的商品已经卖出时不能取消采购单，订单和库存都不变
+def test_delete_purchase_fails_when_stock_is_sold(app, stocked):
+    product_id, location = stocked
+    purchase = app.place_order('采购', '2025-01-01', 1, [{'product_id': product_id, 'quantity': 4, 'price': 6.0}], location)
+    app.place_order('销售', '2025-01-02', 1, [{'product_id': product_id, 'quantity': 8, 'price': 10.0}], location)
+    with pytest.raises(app.InsufficientStockError):
+        app.delete_order(purchase, location)
+    assert count_orders(app, product_id) == 2
+    assert app.get_stock_level(product_id, location) == 1
+
+
+# 更新只能修改订单日期和客户/供应商，总金额和订单类型不能被改写
+def test_update_order_keeps_type_and_total(app, stocked):
+    product_id, location = stocked
+    order_id = app.place_order('销售', '2025-01-01', 1, [{'product_id': product_id, 'quantity': 2, 'price': 10.0}], location)
+    app.update_order(order_id, '2025-02-01', 2)
+    payload = json.dumps({'order_type': '采购', 'order_date': '2025-03-01', 'customer_or_supplier_id': 2, 'total_amount': 1.0})
+    status, _ = app.handle_api_request('PUT', f'/orders/{order_id}', {}, payload.encode('utf-8'))
+    assert status == 400
+    with app.get_connection() as conn:
+        row = conn.execute('SELECT order_type, order_date, customer_or_supplier_id, total_amount FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+    assert row == ('销售', '2025-02-01', 2, 20.0)
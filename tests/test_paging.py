@@ -0,0 +1,30 @@
+import uuid
+
+import pytest
+
+
+def page_through(app, table, order_by, descending, filters):
+    ids, cursor = [], None
+    while True:
+        df, cursor = app.get_page(table, page_size=2, after=cursor, filters=filters, order_by=order_by, descending=descending)
+        ids.extend(int(value) for value in df.iloc[:, 0])
+        if cursor is None:
+            return ids
+
+
+# 排序列含 NULL 时逐页读取不能漏行或重复
+@pytest.mark.parametrize('descending', [False, True])
+def test_keyset_paging_with_nulls(app, descending):
+    tag = f'page-{uuid.uuid4().hex[:8]}'
+    contacts = [None, '张三', None, '李四', '张三', None, '王五']
+    for i, contact in enumerate(contacts):
+        app.add_supplier(f'{tag}-{i}', contact, None, None)
+
+    with app.get_connection() as conn:
+        rows = conn.execute('SELECT supplier_id, contact_name FROM suppliers WHERE name LIKE ?', (f'{tag}-%',)).fetchall()
+    expected = [pk for pk, _ in sorted(rows, key=lambda row: (row[1] is not None, row[1] or '', row[0]))]
+    if descending:
+        expected.reverse()
+
+    assert page_through(app, 'suppliers', 'contact_name', descending, {'name': tag}) == expected
+    assert page_through(app, 'suppliers', 'phone_number', descending, {'name': tag}) == sorted(expected, reverse=descending)
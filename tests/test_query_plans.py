@@ -0,0 +1,21 @@
+import re
+
+import pytest
+
+# 常用查询必须使用迁移建立的二级索引，退化为全表扫描（SCAN）时测试失败
+INDEXED_QUERIES = [
+    ('SELECT stock_id, quantity FROM stock WHERE product_id = ? AND location = ?', (1, '华东仓'), 'idx_stock_product_location'),
+    ('SELECT order_id, total_amount FROM orders WHERE order_date BETWEEN ? AND ?', ('2025-01-01', '2025-01-31'), 'idx_orders_order_date'),
+    ('SELECT order_id FROM orders WHERE order_type = ? AND customer_or_supplier_id = ?', ('销售', 1), 'idx_orders_type_partner'),
+    ("SELECT order_id FROM orders WHERE order_type = '销售' AND order_date BETWEEN ? AND ?", ('2025-01-01', '2025-01-31'), 'idx_orders_type_date'),
+    ('SELECT product_id, quantity, price FROM order_details WHERE order_id = ?', (1,), 'idx_order_details_order'),
+    ('SELECT order_id, quantity FROM order_details WHERE product_id = ?', (1,), 'idx_order_details_product'),
+]
+
+
+@pytest.mark.parametrize('sql, params, index', INDEXED_QUERIES, ids=[index for _, _, index in INDEXED_QUERIES])
+def test_lookup_uses_index(fresh_pool, sql, params, index):
+    with fresh_pool.connection() as conn:
+        plan = ' | '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall())
+    assert re.search(rf'USING (COVERING )?INDEX {index}\b', plan), plan
+    assert not re.search(r'\bSCAN\b', plan), plan
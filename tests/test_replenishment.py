@@ -0,0 +1,63 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def forecasted(app):
+    location = f'test-{uuid.uuid4().hex[:8]}'
+    product_id = app.add_product(f'补货-{location}', None, 8.0, '测试')
+    # 日均需求 10、无波动：再订货点 70，目标库存 210（提前期 7 天 + 盘点周期 14 天）
+    app.save_forecasts([(product_id, 10.0, 10.0, 0.0, 0, '2025-01-01T00:00:00')])
+    app.place_order('采购', '2025-01-01', 101, [{'product_id': product_id, 'quantity': 20, 'price': 3.0}], location)
+    return product_id, location
+
+
+def plan_row(app, product_id):
+    plan = app.get_replenishment_plan()
+    return plan[plan['商品ID'] == product_id]
+
+
+def test_drafts_count_as_on_order(app, forecasted):
+    product_id, location = forecasted
+    row = plan_row(app, product_id)
+    assert row['在库数量'].item() == 20 and row['建议采购量'].item() == 190
+
+    app.place_order('采购', '2025-01-02', 202, [{'product_id': product_id, 'quantity': 50, 'price': 99.0}], location, draft=True)
+    row = plan_row(app, product_id)
+    assert row['在途数量'].item() == 50 and row['建议采购量'].item() == 140
+    # 草稿单不作为最近一次采购：供应商和参考单价仍取已下单的采购单
+    assert row['供应商ID'].item() == 101 and row['参考单价'].item() == 3.0
+
+    app.place_order('采购', '2025-01-03', 202, [{'product_id': product_id, 'quantity': 100, 'price': 99.0}], location, draft=True)
+    assert plan_row(app, product_id).empty
+
+
+def test_drafts_are_created_in_one_transaction(app, forecasted):
+    product_id, location = forecasted
+    other = app.add_product(f'补货-{location}-2', None, 8.0, '测试')
+    plan = app.pd.DataFrame({'商品ID': [product_id, other, other], '供应商ID': [101, 303, None],
+                             '建议采购量': [190, 0, 5], '参考单价': [3.0, 4.0, 4.0]})
+
+    def count_drafts():
+        with app.get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM orders WHERE status = '草稿' AND customer_or_supplier_id IN (101, 303)").fetchone()[0]
+
+    before = count_drafts()
+    with pytest.raises(ValueError):
+        app.create_draft_purchase_orders(plan, location=location)
+    assert count_drafts() == before
+
+    plan.loc[1, '建议采购量'] = 7
+    order_ids = app.create_draft_purchase_orders(plan, location=location)
+    assert set(order_ids) == {101, 303}
+    assert count_drafts() == before + 2
+
+
+# 进程池（forkserver / spawn 启动的子进程）分块拟合的结果与单进程相同
+def test_batched_fit_matches_single_process(app):
+    rng = app.np.random.default_rng(7)
+    history = rng.poisson(5, size=(app.PARALLEL_MIN_SKUS, 30)).astype(float)
+    expected = app.fit_demand(history)
+    for actual, single in zip(app.fit_demand_batched(history, workers=2), expected):
+        app.np.testing.assert_allclose(actual, single)
@@ -0,0 +1,25 @@
+import uuid
+
+
+# 最相关的结果排在全部匹配之后插入时也要返回：排序必须覆盖全部匹配，而不是先截取前若干条
+def test_best_match_beyond_first_candidates(app):
+    tag = f'q{uuid.uuid4().hex[:8]}'
+    filler = ' '.join(f'词{i}' for i in range(40))
+    app.insert_rows('products', ['name', 'description', 'price', 'category'],
+                    [(f'普通商品{i}', f'{filler} {tag}', 1.0, '测试') for i in range(600)])
+    best = app.add_product(tag, tag, 1.0, tag)
+
+    results = app.search_records('products', tag, limit=5)
+    assert len(results) == 5
+    assert int(results.iloc[0, 0]) == best
+
+
+# 匹配超过 SEARCH_RANK_LIMIT 条时不排序，按记录 ID 返回前 limit 条；少于 SEARCH_MIN_CHARS 个字时不搜索
+def test_broad_prefix_is_bounded(app):
+    tag = f'w{uuid.uuid4().hex[:8]}'
+    app.insert_rows('products', ['name', 'description', 'price', 'category'],
+                    [(f'{tag}{i}', None, 1.0, '测试') for i in range(app.SEARCH_RANK_LIMIT + 10)])
+    results = app.search_records('products', tag, limit=5)
+    ids = [int(record_id) for record_id in results.iloc[:, 0]]
+    assert len(ids) == 5 and ids == sorted(ids)
+    assert app.search_records('products', tag[0]).empty
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# 分库设置在导入时读取，每一步在单独的进程中执行
+def run_app(tmp_path, code, sharded=True):
+    env = {**os.environ, 'INVENTORY_DB': str(tmp_path / 'central.db'), 'INVENTORY_JOB_WORKERS': '0'}
+    env.pop('INVENTORY_SHARD_DIR', None)
+    if sharded:
+        env['INVENTORY_SHARD_DIR'] = str(tmp_path / 'warehouses')
+    script = 'import apptest as app\n' + textwrap.dedent(code)
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return result.stdout
+
+
+# 启用分库之前中心库里的库存，在仓库建立分库后仍然可以出库，合并查询和汇总表保持一致
+def test_existing_stock_moves_into_new_shard(tmp_path):
+    run_app(tmp_path, '''
+        product_id = app.add_product('苹果', None, 5.0, '食品')
+        app.add_stock(product_id, 10, '华东仓')
+        app.add_stock(product_id, 4, '华南仓')
+    ''', sharded=False)
+
+    output = run_app(tmp_path, '''
+        app.place_order('销售', '2025-01-01', 1, [{'product_id': 1, 'quantity': 8, 'price': 5.0}], '华东仓')
+        print(app.get_stock_level(1, '华东仓'), app.get_stock_level(1), len(app.verify_stock_levels()))
+        print(int(app.get_stock_as_of('2999-01-01')['在库数量'].sum()))
+    ''')
+    assert output.split()[-4:] == ['2', '6', '0', '6']
+    with sqlite3.connect(tmp_path / 'central.db') as conn:
+        assert conn.execute("SELECT location, quantity FROM stock").fetchall() == [('华南仓', 4)]
+
+
+# 旧版本建立的分库：中心库里遗留的库存在启动时移入分库
+def test_stranded_stock_moves_on_startup(tmp_path):
+    run_app(tmp_path, '''
+        product_id = app.add_product('梨', None, 4.0, '食品')
+        app.add_stock(product_id, 3, '华东仓')
+    ''')
+    with sqlite3.connect(tmp_path / 'central.db') as conn:
+        conn.execute("INSERT INTO stock (product_id, quantity, location) VALUES (1, 8, '华东仓')")
+
+    output = run_app(tmp_path, '''
+        app.place_order('销售', '2025-01-01', 1, [{'product_id': 1, 'quantity': 10, 'price': 4.0}], '华东仓')
+        print(app.get_stock_level(1, '华东仓'), len(app.verify_stock_levels()))
+    ''')
+    assert output.split()[-2:] == ['1', '0']
+
+
+# 新建的中心库和分库都是增量回收模式，定期的空间回收任务可以直接回收空闲页
+def test_new_shards_use_incremental_vacuum(tmp_path):
+    run_app(tmp_path, '''
+        product_id = app.add_product('桃', None, 3.0, '食品')
+        app.add_stock(product_id, 5, '华东仓')
+    ''')
+    paths = [tmp_path / 'central.db'] + sorted((tmp_path / 'warehouses').glob('*.db'))
+    assert len(paths) == 2
+    for path in paths:
+        with sqlite3.connect(path) as conn:
+            assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
@@ -0,0 +1,28 @@
+import io
+import uuid
+
+
+# 每种写入路径之后，触发器维护的汇总表都应与 stock 明细的合计一致
+def test_triggers_keep_stock_levels_consistent(app):
+    location = f'test-{uuid.uuid4().hex[:8]}'
+    other = f'{location}-b'
+    first = app.add_product(f'商品-{location}-1', None, 10.0, '测试')
+    second = app.add_product(f'商品-{location}-2', None, 10.0, '测试')
+
+    stock_id = app.add_stock(first, 10, location)
+    app.add_stock(first, 4, location)
+    app.update_stock(stock_id, second, 7, location)
+    moved = app.add_stock(first, 3, other)
+    app.delete_stock(moved)
+    app.place_order('采购', '2025-01-01', 1, [{'product_id': first, 'quantity': 6, 'price': 1.0}], location)
+    app.place_order('销售', '2025-01-02', 1, [{'product_id': first, 'quantity': 8, 'price': 2.0}, {'product_id': second, 'quantity': 2, 'price': 2.0}], location)
+    draft = app.place_order('销售', '2025-01-03', 1, [{'product_id': second, 'quantity': 5, 'price': 2.0}], location, draft=True)
+    app.confirm_order(draft, location)
+    csv = f'product_id,quantity,location\n{first},5,{other}\n{second},9,{other}\n'
+    app.bulk_import('stock', io.StringIO(csv), 'stock.csv')
+
+    assert app.verify_stock_levels().empty
+    assert app.get_stock_level(first, location) == 2
+    assert app.get_stock_level(second, location) == 0
+    assert app.get_stock_level(first) == 7
+    assert app.get_stock_level(second) == 9